@@ -0,0 +1,35 @@
+import logging
+import logging.handlers
+import queue
+
+import state
+
+logger = logging.getLogger("faas")
+_listener = None
+
+def start_logging():
+    """
+    Routes the 'faas' logger through a queue, so that record formatting and
+    stdout writes happen on a background thread instead of the event loop.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    log_queue = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    logger.setLevel(state.LOG_LEVEL)
+    logger.propagate = False
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    _listener.start()
+
+def stop_logging():
+    """Flushes the queued records and stops the background listener."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
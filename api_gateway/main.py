@@ -1,14 +1,27 @@
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import PlainTextResponse, Response
+from starlette.concurrency import run_in_threadpool
+from typing import Dict
+import asyncio
 import time
-import uuid
 import os
-import pandas as pd
+import shlex
+import orjson
 
 import state
 import models
 import policies
 import node_manager
 import metrics
+import metrics_cache
+from log_config import logger, start_logging, stop_logging
+
+# uvicorn already picks uvloop (see the Dockerfile); this covers any other way of running the app.
+try:
+    import uvloop
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+except ImportError:
+    pass
 
 app = FastAPI(
     title="FaaS Gateway",
@@ -18,6 +31,7 @@ app = FastAPI(
 DEFAULT_SCHEDULING_POLICY = policies.RoundRobinPolicy()
 # DEFAULT_SCHEDULING_POLICY = policies.LeastUsedPolicy()
 # DEFAULT_SCHEDULING_POLICY = policies.MostUsedPolicy()
+# DEFAULT_SCHEDULING_POLICY = policies.PowerOfTwoChoicesPolicy()
 
 WARMING_TYPE = models.EXECUTION_MODES.COLD.value
 # WARMING_TYPE = models.EXECUTION_MODES.PRE_WARMED.value
@@ -26,83 +40,213 @@ WARMING_TYPE = models.EXECUTION_MODES.COLD.value
 SCHEDULING_POLICY = policies.StaticWarmingPolicy()
 NODE_SELECTION_POLICY = policies.WarmedFirstPolicy()
 
+# Bound once at import, so the invoke path does not resolve the method on every request.
+_select_node = NODE_SELECTION_POLICY.select_node
+
+background_tasks = []
+# Connection set-up and warming of just registered nodes; referenced here so they are not garbage collected.
+node_preparation_tasks = set()
+# Serialized /nodes body, tagged with the node_registry_version it was built from.
+_nodes_response = (-1, b"")
+# (function_registry snapshot, encoded body): add_function publishes a new mapping on every change.
+_functions_response = (None, b"")
+
 @app.on_event("startup")
 async def startup_event():
     """
     When the server starts, it checks whether a previous metrics file exists.
-    If it does, it loads the data into the current session.
+    If it does, it loads the data into the current session, then opens the
+    file for appending new rows.
     """
-    csv_path = os.path.join(state.RESULTS_DIR, "metrics.csv")
+    start_logging()
+    # Experiments are only comparable on the same loop: record whether uvloop is in use.
+    logger.info("Event loop: %s", type(asyncio.get_running_loop()).__module__)
     
     os.makedirs(state.RESULTS_DIR, exist_ok=True)
 
-    if os.path.exists(csv_path):
+    if os.path.exists(metrics.METRICS_CSV_PATH):
         try:
-            df_existing = pd.read_csv(csv_path)
-            state.metrics_log.extend(df_existing.to_dict('records'))
+            await run_in_threadpool(metrics.restore_metrics_log, metrics.METRICS_CSV_PATH)
         except Exception as e:
-            print(f"Warning: unable to read existing metrics file. Error: {e}")
+            logger.warning("Unable to read existing metrics file. Error: %s", e)
+
+    metrics.open_metrics_csv()
+    background_tasks.append(asyncio.create_task(metrics.write_metrics_batches()))
+    background_tasks.append(asyncio.create_task(node_manager.reap_idle_connections()))
+    if getattr(DEFAULT_SCHEDULING_POLICY, "uses_metrics_cache", False):
+        background_tasks.append(asyncio.create_task(metrics_cache.refresh_metrics_periodically()))
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """
+    Flushes the queued metrics, stops the background tasks, removes the warmed
+    containers and closes the pooled SSH connections and the metrics files.
+    """
+    await metrics.flush_metrics()
+    for task in (*background_tasks, *node_preparation_tasks):
+        task.cancel()
+    await asyncio.gather(*background_tasks, *node_preparation_tasks, return_exceptions=True)
+    background_tasks.clear()
+
+    await node_manager.stop_event_watchers()
+    await node_manager.remove_pooled_containers()
+    await node_manager.drain_image_removals()
+    await node_manager.close_all_connections()
+
+    metrics.close_metrics_csv()
+    stop_logging()
+
+_HEALTHZ_BODY = orjson.dumps({"status": "ok"})
+
+@app.get("/healthz")
+async def healthz():
+    # Touches no registry, cache or connection, so it answers even while the gateway is busy scheduling.
+    return Response(content=_HEALTHZ_BODY, media_type="application/json")
 
 @app.post("/functions/register")
 async def register_function(req: models.RegisterFunctionRequest):
-    if req.name in state.function_registry:
+    try:
+        function_details = node_manager.build_function_record(req.name, req.image, req.command)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid command for function '{req.name}': {e}")
+    if not state.add_function(req.name, function_details):
         raise HTTPException(status_code=400, detail=f"Function ‘{req.name}’ already registered.")
-    state.function_registry[req.name] = {"image": req.image, "command": req.command}
     await SCHEDULING_POLICY.apply(WARMING_TYPE, req.name, DEFAULT_SCHEDULING_POLICY)
     return {"status": "success", "message": f"Function '{req.name}' registered."}
 
+@app.post("/functions/warm-all/{function_name}")
+async def warm_function_on_all_nodes(function_name: str, mode: str = models.EXECUTION_MODES.WARMED.value):
+    if function_name not in state.function_registry:
+        raise HTTPException(status_code=404, detail=f"Function '{function_name}' not found.")
+    if mode not in (models.EXECUTION_MODES.PRE_WARMED.value, models.EXECUTION_MODES.WARMED.value):
+        raise HTTPException(status_code=400, detail=f"Unsupported warming mode '{mode}'.")
+    node_names = list(state.node_registry)
+    await SCHEDULING_POLICY.apply_to_nodes(mode, function_name, node_names)
+    return {"status": "success", "message": f"Function '{function_name}' {mode} on {len(node_names)} nodes."}
+
+async def prepare_new_node(node_name: str):
+    """
+    Opens the SSH connection of a just registered node, then applies WARMING_TYPE to every
+    function already registered, so the first invocations on the node skip that work.
+    """
+    node_info = state.node_registry.get(node_name)
+    if node_info is None:
+        return
+    await node_manager.connect_node(node_info)
+    await asyncio.gather(*(
+        SCHEDULING_POLICY.apply_to_nodes(WARMING_TYPE, function_name, [node_name])
+        for function_name in state.function_registry
+    ))
+
 @app.post("/nodes/register")
-def register_node(req: models.RegisterNodeRequest):
-    if req.name in state.node_registry:
-        raise HTTPException(status_code=400, detail=f"Node '{req.name}' already registered.")
-    state.node_registry[req.name] = {
+async def register_node(req: models.RegisterNodeRequest):
+    if not req.password and not req.private_key and not req.private_key_path:
+        raise HTTPException(status_code=400, detail="Either a password, a private key or a private key path is required.")
+    node_info = {
+        "name": req.name,
         "host": req.host,
         "port": req.port,
         "username": req.username,
-        "password": req.password
+        "private_key_path": req.private_key_path
     }
+    secrets = {"password": req.password, "private_key": req.private_key}
+    if not state.add_node(req.name, node_info, secrets):
+        raise HTTPException(status_code=400, detail=f"Node '{req.name}' already registered.")
+    metrics_cache.invalidate_node_metrics(req.name)
+    task = asyncio.create_task(prepare_new_node(req.name))
+    node_preparation_tasks.add(task)
+    task.add_done_callback(node_preparation_tasks.discard)
     return {"status": "success", "message": f"Node '{req.name}' registered."}
 
+@app.post("/nodes/unregister/{node_name}")
+async def unregister_node(node_name: str):
+    node_info = state.remove_node(node_name)
+    if node_info is None:
+        raise HTTPException(status_code=404, detail=f"Node '{node_name}' not found.")
+    metrics_cache.invalidate_node_metrics(node_name)
+    await node_manager.release_node(node_name, node_info)
+    return {"status": "success", "message": f"Node '{node_name}' unregistered."}
+
+@app.get("/nodes", response_model=Dict[str, models.NodeView])
+async def list_nodes():
+    global _nodes_response
+    version, body = _nodes_response
+    if version != state.node_registry_version:
+        version = state.node_registry_version
+        body = orjson.dumps(dict(state.node_registry))
+        _nodes_response = (version, body)
+    return Response(content=body, media_type="application/json")
+
+@app.get("/functions", response_model=Dict[str, models.FunctionView])
+async def list_functions():
+    global _functions_response
+    registry, body = _functions_response
+    if registry is not state.function_registry:
+        registry = state.function_registry
+        body = orjson.dumps({
+            name: {"image": details.image, "command": details.command}
+            for name, details in registry.items()
+        })
+        _functions_response = (registry, body)
+    return Response(content=body, media_type="application/json")
+
+@app.get("/nodes/load")
+async def nodes_load():
+    await metrics_cache.get_all_node_metrics(state.node_registry)
+    return [{"node": name, "load": load} for name, load in metrics_cache.node_load_vector()]
+
+@app.get("/metrics/table", response_class=PlainTextResponse)
+async def metrics_table():
+    return await metrics.render_metrics_grid()
+
+@app.get("/metrics/summary")
+async def metrics_summary():
+    return metrics.metrics_summary()
+
+@app.post("/metrics/flush")
+async def flush_metrics():
+    await metrics.flush_metrics()
+    return {"status": "success", "rows": len(state.metrics_log)}
+
 @app.post("/functions/invoke/{function_name}")
 async def invoke_function(function_name: str):
-    start_time = time.perf_counter()
-    if function_name not in state.function_registry:
+    start_ns = time.monotonic_ns()
+    function_details = state.function_registry.get(function_name)
+    if function_details is None:
         raise HTTPException(status_code=404, detail=f"Function '{function_name}' not found.")
     if not state.node_registry:
         raise HTTPException(status_code=503, detail="No nodes available for execution.")
 
-    function_details = state.function_registry[function_name]
-    
     try:
-        node_name, metric_to_write, execution_mode = await NODE_SELECTION_POLICY.select_node(function_name, DEFAULT_SCHEDULING_POLICY)
+        node_name, metric_to_write, execution_mode = await _select_node(function_name, DEFAULT_SCHEDULING_POLICY)
         node_info = state.node_registry[node_name]
-        command_to_run = function_details["command"]
-        image_name = function_details["image"]
+        image_name = function_details.image
 
         if execution_mode == models.EXECUTION_MODES.WARMED.value:
-            container_name = f"{state.CONTAINER_PREFIX}{function_name}--{node_name}"
-            docker_cmd = f"sudo docker exec {container_name} {command_to_run}"
+            node_manager.touch_pooled_container(node_name, image_name)
+            docker_cmd = state.warm_commands.get((function_name, node_name))
+            if docker_cmd is None:
+                docker_cmd = "docker exec " + shlex.quote(node_manager.warm_container_name(node_name, image_name)) + function_details.exec_suffix
         else:
-            unique_id = str(uuid.uuid4())[:8]
-            container_name = f"{state.CONTAINER_PREFIX}{function_name}--{unique_id}"
-            docker_cmd = f"sudo docker run --rm --name {container_name} {image_name} {command_to_run}"
+            if execution_mode == models.EXECUTION_MODES.COLD.value:
+                await node_manager.wait_for_image_removal(image_name)
+            docker_cmd = function_details.run_prefix + os.urandom(4).hex() + function_details.run_suffix
         
-        output = await node_manager.run_ssh_command(node_info, docker_cmd)
-        print(f"Output: {output}")
+        # Never re-run: the invocation may already have started on the node before its connection was lost.
+        output = await node_manager.run_ssh_command(node_info, docker_cmd, retry=False)
+        logger.debug("Output: %s", output)
 
-        if models.EXECUTION_MODES.COLD.label in execution_mode:
-            try:
-                cleanup_cmd = f"sudo docker rmi {image_name}"
-                await node_manager.run_ssh_command(node_info, cleanup_cmd)
-            except Exception as e:
-                print(f"Unable to remove image from node '{node_name} : {e}")
+        if execution_mode == models.EXECUTION_MODES.COLD.value:
+            node_manager.schedule_image_removal(node_name, node_info, function_details)
 
     except Exception as e:
-        end_time = time.perf_counter()
-        duration = end_time - start_time
-        print(f"Invocation failed after {duration:.4f} seconds: {e}")
+        elapsed_ns = time.monotonic_ns() - start_ns
+        logger.error("Invocation failed after %.4f seconds: %s", elapsed_ns / 1e9, e)
         raise HTTPException(status_code=500, detail=f"Invocation of the failed function: {e}")
 
-    end_time = time.perf_counter()
-    duration = end_time - start_time
-    await metrics.log_invocation_metrics(metric_to_write, function_name, node_name, execution_mode, duration)
\ No newline at end of file
+    elapsed_ns = time.monotonic_ns() - start_ns
+    # The scheduler did not record node metrics: take a fresh reading now that the run is over, outside
+    # the timed window, so neither the probe nor get_node_metrics.sh's 0.1 s sample adds to elapsed_ns.
+    # Concurrent invocations on one node join the probe already in flight instead of each running their own.
+    node_metrics = None if metric_to_write else await metrics_cache.probe_node_metrics(node_name, node_info)
+    await metrics.log_invocation_metrics(metric_to_write, function_name, node_name, execution_mode, elapsed_ns, node_metrics)
\ No newline at end of file
@@ -1,41 +1,237 @@
-import pandas as pd
-from tabulate import tabulate
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Tuple
+import asyncio
+import random
+import statistics
+import csv
+import io
 import os
 
 import state
-from models import EXECUTION_MODES, EXECUTION_MODE_MAP
-from node_manager import get_metrics_for_node
+from log_config import logger
+from models import EXECUTION_MODE_MAP
 
-def write_metrics_files():
-    if not state.metrics_log:
-        return
+METRICS_FIELDNAMES = ["Function", "Node", "CPU Usage %", "RAM Usage %", "Execution Mode", "Execution Time (s)"]
+_EXECUTION_TIME_INDEX = METRICS_FIELDNAMES.index("Execution Time (s)")
+METRICS_CSV_PATH = os.path.join(state.RESULTS_DIR, "metrics.csv")
+METRICS_TABLE_PATH = os.path.join(state.RESULTS_DIR, "metrics_table.txt")
+# Fixed column widths for metrics_table.txt, so each row can be appended without re-reading the rest.
+# They fit the client's function names (up to 30 characters), the ssh_node_N nodes and the longest
+# mode label, "Power of Two Choices - Cold". A longer value is written whole, only pushing its row out.
+_TABLE_COL_WIDTHS = [32, 16, 12, 12, 28, 18]
 
-    try:
-        df = pd.DataFrame(state.metrics_log)
-        
-        table_output_path = os.path.join(state.RESULTS_DIR, "metrics_table.txt")
-        table = tabulate(df, headers='keys', tablefmt='grid', showindex=False)
-        with open(table_output_path, 'w') as f:
-            f.write(table)
-            
-        csv_output_path = os.path.join(state.RESULTS_DIR, "metrics.csv")
-        df.to_csv(csv_output_path, index=False)
+_csv_fd = None
+_table_fd = None
+# All metrics file I/O runs on this one thread, so appends and grid renders never contend.
+_writer_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="metrics-writer")
+# Rows waiting for the batch writer; drained by write_metrics_batches.
+_metrics_queue: asyncio.Queue = asyncio.Queue()
+# Set whenever metrics_log gains rows, so the grid is only re-rendered when it would change.
+_table_dirty = True
+_last_table = ""
+# Reused to quote one row at a time; only touched by the metrics writer thread (and at startup).
+_line_buffer = io.StringIO()
+_line_writer = csv.writer(_line_buffer, lineterminator="\n")
+
+class _RunningStats:
+    """Welford's running mean/variance plus a bounded reservoir sample for quartiles."""
+    __slots__ = ("count", "mean", "m2", "samples")
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.samples = []
+
+    def add(self, value: float):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        if len(self.samples) < state.METRICS_RESERVOIR_SIZE:
+            self.samples.append(value)
+        else:
+            slot = random.randrange(self.count)
+            if slot < state.METRICS_RESERVOIR_SIZE:
+                self.samples[slot] = value
+
+# Execution time aggregates keyed by (function, execution mode), updated as rows are logged.
+_category_stats: Dict[Tuple[str, str], _RunningStats] = {}
 
+def _format_csv_line(values) -> bytes:
+    _line_buffer.seek(0)
+    _line_buffer.truncate()
+    _line_writer.writerow(values)
+    return _line_buffer.getvalue().encode()
+
+def _format_table_line(values) -> bytes:
+    return (" | ".join(str(v).ljust(w) for v, w in zip(values, _TABLE_COL_WIDTHS)) + "\n").encode()
+
+def _row_values(row):
+    """
+    The row's values in METRICS_FIELDNAMES order. Rows logged in this session keep their
+    duration as integer nanoseconds, converted to seconds only here, when written out.
+    """
+    values = [row.get(field, "") for field in METRICS_FIELDNAMES]
+    elapsed_ns = row.get("elapsed_ns")
+    if elapsed_ns is not None:
+        values[_EXECUTION_TIME_INDEX] = f"{elapsed_ns / 1e9:.4f}"
+    return values
+
+def _record_execution_time(function_name, execution_mode, seconds):
+    stats = _category_stats.get((function_name, execution_mode))
+    if stats is None:
+        stats = _category_stats[(function_name, execution_mode)] = _RunningStats()
+    stats.add(seconds)
+
+def restore_metrics_log(csv_path):
+    """
+    Blocking: streams a previous session's metrics.csv into the running aggregates, which
+    see every row, and the metrics log, which only keeps the last METRICS_LOG_MAXLEN.
+    The file is never held in memory as a whole.
+    """
+    with open(csv_path, newline="") as f:
+        for row in csv.DictReader(f):
+            state.metrics_log.append(row)
+            try:
+                seconds = float(row["Execution Time (s)"])
+            except (KeyError, TypeError, ValueError):
+                continue
+            _record_execution_time(row.get("Function"), row.get("Execution Mode"), seconds)
+
+def metrics_summary():
+    """Per function and execution mode: count, mean and stdev of all runs, quartiles of the sample."""
+    summary = []
+    for (function_name, execution_mode), stats in _category_stats.items():
+        entry = {
+            "function": function_name, "mode": execution_mode, "count": stats.count,
+            "mean": stats.mean,
+            "stdev": (stats.m2 / (stats.count - 1)) ** 0.5 if stats.count > 1 else 0.0,
+        }
+        if len(stats.samples) > 1:
+            entry["q1"], entry["median"], entry["q3"] = statistics.quantiles(stats.samples, n=4)
+        else:
+            entry["q1"] = entry["median"] = entry["q3"] = stats.mean
+        summary.append(entry)
+    return summary
+
+def _open_append(path, header: bytes):
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+    if os.fstat(fd).st_size == 0:
+        os.write(fd, header)
+    return fd
+
+def open_metrics_csv():
+    """
+    Opens metrics.csv and metrics_table.txt once as O_APPEND descriptors. metrics.csv only
+    gets its header if it is new; metrics_table.txt is started over, whatever layout a
+    previous session left in it, with the header and the rows restored into the metrics log.
+    """
+    global _csv_fd, _table_fd
+    _csv_fd = _open_append(METRICS_CSV_PATH, _format_csv_line(METRICS_FIELDNAMES))
+    _table_fd = os.open(METRICS_TABLE_PATH, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_APPEND, 0o644)
+    os.write(_table_fd, b"".join((
+        _format_table_line(METRICS_FIELDNAMES),
+        _format_table_line("-" * w for w in _TABLE_COL_WIDTHS),
+        *(_format_table_line(_row_values(row)) for row in state.metrics_log),
+    )))
+
+def close_metrics_csv():
+    global _csv_fd, _table_fd
+    _writer_executor.shutdown(wait=True)
+    for fd in (_csv_fd, _table_fd):
+        if fd is not None:
+            os.close(fd)
+    _csv_fd = _table_fd = None
+
+def _append_metrics_rows(rows):
+    """
+    Blocking: appends a batch of rows to metrics.csv and metrics_table.txt with
+    one write() syscall per file; O_APPEND keeps each batch whole.
+    """
+    if _csv_fd is None:
+        return
+    try:
+        values = [_row_values(row) for row in rows]
+        os.write(_csv_fd, b"".join(_format_csv_line(v) for v in values))
+        os.write(_table_fd, b"".join(_format_table_line(v) for v in values))
     except Exception as e:
-        print(f"Error while writing metric files: {e}")
+        logger.error("Error while appending to the metrics file: %s", e)
+
+async def write_metrics_batches():
+    """
+    Drains the metrics queue for the lifetime of the app, collecting up to
+    METRICS_BATCH_SIZE rows (or whatever arrives within METRICS_BATCH_TIMEOUT)
+    and handing each batch to a worker thread.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await _metrics_queue.get()]
+        deadline = loop.time() + state.METRICS_BATCH_TIMEOUT
+        while len(batch) < state.METRICS_BATCH_SIZE:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(_metrics_queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        try:
+            await asyncio.get_running_loop().run_in_executor(_writer_executor, _append_metrics_rows, batch)
+        except Exception as e:
+            # A failed batch must not stop the writer, or flush_metrics would wait forever.
+            logger.error("Unable to write a batch of %d metrics rows: %s", len(batch), e)
+        finally:
+            for _ in batch:
+                _metrics_queue.task_done()
+
+async def flush_metrics():
+    """Waits until every queued row has been written to metrics.csv."""
+    await _metrics_queue.join()
+
+def format_metrics_grid(rows) -> str:
+    """Blocking: renders rows as a grid table."""
+    if not rows:
+        return ""
+    # Only GET /metrics/table needs tabulate, so it is not imported with the gateway.
+    from tabulate import tabulate
+    return tabulate([_row_values(row) for row in rows], headers=METRICS_FIELDNAMES, tablefmt='grid')
+
+async def render_metrics_grid() -> str:
+    """
+    Renders the in-memory metrics log on the metrics writer thread, or returns the last
+    grid when no rows were logged since. The log is copied here, on the event loop, so
+    the writer thread never iterates it while invocations append to it.
+    """
+    global _table_dirty, _last_table
+    if not _table_dirty:
+        return _last_table
+    _table_dirty = False
+    rows = list(state.metrics_log)
+    try:
+        _last_table = await asyncio.get_running_loop().run_in_executor(_writer_executor, format_metrics_grid, rows)
+    except Exception:
+        _table_dirty = True
+        raise
+    return _last_table
 
-async def log_invocation_metrics(metric_to_write, function_name, node_name, execution_mode, duration):
+async def log_invocation_metrics(metric_to_write, function_name, node_name, execution_mode, elapsed_ns, node_metrics=None):
+    """
+    Records one invocation. When the scheduler did not produce a metric entry,
+    node_metrics (probed right after the invocation) fills the CPU/RAM columns.
+    """
+    global _table_dirty
     if not metric_to_write:
-        node_info = state.node_registry.get(node_name)
-        metrics = await get_metrics_for_node(node_name, node_info) if node_info else None
         metric_to_write = {
             "Function": function_name, "Node": node_name,
-            "CPU Usage %": metrics.get("cpu_usage") if metrics else "---",
-            "RAM Usage %": metrics.get("ram_usage") if metrics else "---",
+            "CPU Usage %": node_metrics.cpu_usage if node_metrics else "---",
+            "RAM Usage %": node_metrics.ram_usage if node_metrics else "---",
         }
 
-    metric_to_write["Execution Mode"] = EXECUTION_MODE_MAP.get(execution_mode, execution_mode)
-    metric_to_write["Execution Time (s)"] = f"{duration:.4f}"
+    # Cold rows already carry the label of the policy that scheduled them.
+    metric_to_write.setdefault("Execution Mode", EXECUTION_MODE_MAP.get(execution_mode, execution_mode))
+    metric_to_write["elapsed_ns"] = elapsed_ns
+    _record_execution_time(function_name, metric_to_write["Execution Mode"], elapsed_ns / 1e9)
     state.metrics_log.append(metric_to_write)
-    
-    write_metrics_files()
+    _table_dirty = True
+    _metrics_queue.put_nowait(metric_to_write)
@@ -0,0 +1,195 @@
+from typing import Dict, Any, List, Optional, Tuple
+import asyncio
+import random
+import time
+
+import state
+from log_config import logger
+from models import NodeMetrics
+from node_manager import PoolKey, get_metrics_for_node, group_nodes_by_endpoint, pool_key
+
+# Per-node cache entries: (fetched_at, metrics).
+_node_metrics: Dict[str, Tuple[float, NodeMetrics]] = {}
+_inflight_probes: Dict[PoolKey, asyncio.Task] = {}
+_probe_semaphore = asyncio.Semaphore(state.SSH_FANOUT_LIMIT)
+
+# Last view handed to the policies, reused until its oldest entry expires.
+_snapshot_nodes: Optional[Dict[str, Any]] = None
+_snapshot_expires_at = float('-inf')
+_metrics_snapshot: Dict[str, NodeMetrics] = {}
+# (least used, most used) eligible node of the snapshot, or () when none is eligible.
+_eligible_extremes: Tuple[Tuple[str, NodeMetrics], ...] = ()
+# Sorted on first use, since only GET /nodes/load reads it.
+_load_vector: Optional[Tuple[Tuple[str, float], ...]] = None
+
+def _cpu_usage(item: Tuple[str, NodeMetrics]) -> float:
+    return item[1].cpu_usage
+
+async def _probe_endpoint(names: List[str], node_info: Dict[str, Any]):
+    """Probes one SSH endpoint and stores the result for every node name behind it."""
+    async with _probe_semaphore:
+        try:
+            metrics = await asyncio.wait_for(get_metrics_for_node(names[0], node_info), timeout=state.METRICS_PROBE_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning("Metrics probe of '%s' timed out after %ss.", names[0], state.METRICS_PROBE_TIMEOUT)
+            metrics = None
+
+    fetched_at = time.monotonic()
+    for name in names:
+        if metrics:
+            _node_metrics[name] = (fetched_at, metrics)
+            continue
+        # A failed probe keeps the last known metrics until they are too old to schedule on.
+        entry = _node_metrics.get(name)
+        if entry is not None and fetched_at - entry[0] > state.METRICS_STALE_MAX_AGE:
+            _node_metrics.pop(name, None)
+
+def _refresh_endpoint(key: PoolKey, names: List[str], node_info: Dict[str, Any]) -> asyncio.Task:
+    """Starts a probe of the endpoint, or joins the one already in flight."""
+    task = _inflight_probes.get(key)
+    if task is None:
+        task = asyncio.create_task(_probe_endpoint(names, node_info))
+        _inflight_probes[key] = task
+        task.add_done_callback(lambda _: _inflight_probes.pop(key, None))
+    return task
+
+def _has_idle_node(nodes: Dict[str, Any], max_age: float, early_exit_load: float) -> bool:
+    now = time.monotonic()
+    for name in nodes:
+        entry = _node_metrics.get(name)
+        if entry is not None and now - entry[0] < max_age and entry[1].load < early_exit_load:
+            return True
+    return False
+
+async def refresh_node_metrics(nodes: Dict[str, Any], max_age: float, deadline: Optional[float] = None,
+                               early_exit_load: Optional[float] = None):
+    """
+    Probes, in parallel, every SSH endpoint whose nodes have metrics older than max_age.
+    With a deadline, returns once it expires as long as some node has metrics; with
+    early_exit_load, returns as soon as a node with fresh metrics reports a lower load.
+    The probes still pending keep running and fill the cache for later calls.
+    """
+    now = time.monotonic()
+    tasks = [
+        _refresh_endpoint(key, names, nodes[names[0]])
+        for key, names in group_nodes_by_endpoint(nodes).items()
+        if any(now - _node_metrics.get(name, (float('-inf'), None))[0] >= max_age for name in names)
+    ]
+    if not tasks:
+        return
+    # Unlike gather, wait does not cancel the shared probes if this caller is cancelled.
+    if early_exit_load is None:
+        _, pending = await asyncio.wait(tasks, timeout=deadline)
+    else:
+        loop = asyncio.get_running_loop()
+        stop_at = None if deadline is None else loop.time() + deadline
+        pending = set(tasks)
+        while pending and not _has_idle_node(nodes, max_age, early_exit_load):
+            timeout = None if stop_at is None else max(0.0, stop_at - loop.time())
+            done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                break
+    while pending and not any(name in _node_metrics for name in nodes):
+        _, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+
+async def _join_node_probe(node_name: str, node_info: Dict[str, Any]):
+    key = pool_key(node_info)
+    names = [name for name, info in state.node_items if pool_key(info) == key] or [node_name]
+    await asyncio.wait([_refresh_endpoint(key, names, node_info)])
+
+async def get_node_metrics(node_name: str, node_info: Dict[str, Any]) -> Optional[NodeMetrics]:
+    """Returns the metrics of one node, probing it only when its cached entry is older than METRICS_CACHE_TTL."""
+    entry = _node_metrics.get(node_name)
+    if entry is None or time.monotonic() - entry[0] >= state.METRICS_CACHE_TTL:
+        await _join_node_probe(node_name, node_info)
+        entry = _node_metrics.get(node_name)
+    return entry[1] if entry else None
+
+async def probe_node_metrics(node_name: str, node_info: Dict[str, Any]) -> Optional[NodeMetrics]:
+    """
+    Returns metrics of one node read after this call, never a cached entry, or None if
+    the probe fails. A probe of the node's endpoint already in flight is joined, so
+    concurrent callers on one node share a single get_node_metrics.sh run.
+    """
+    requested_at = time.monotonic()
+    await _join_node_probe(node_name, node_info)
+    entry = _node_metrics.get(node_name)
+    return entry[1] if entry and entry[0] >= requested_at else None
+
+async def get_all_node_metrics(nodes: Dict[str, Any], early_exit_load: Optional[float] = None) -> Dict[str, NodeMetrics]:
+    """
+    Returns the metrics of the given nodes. Only nodes whose cached metrics are older
+    than METRICS_CACHE_TTL are probed; concurrent misses on the same SSH endpoint share
+    one probe, at most SSH_FANOUT_LIMIT probes run at once and a slow node is given up
+    on after METRICS_PROBE_TIMEOUT, falling back to its last metrics if they are no older
+    than METRICS_STALE_MAX_AGE. Selection does not wait past METRICS_SELECTION_DEADLINE
+    for slow nodes once others have answered, nor, with early_exit_load, once a node
+    reports a load below it.
+    """
+    global _snapshot_nodes, _snapshot_expires_at, _metrics_snapshot, _eligible_extremes, _load_vector
+    if nodes is _snapshot_nodes and time.monotonic() < _snapshot_expires_at:
+        return _metrics_snapshot
+
+    await refresh_node_metrics(nodes, state.METRICS_CACHE_TTL, state.METRICS_SELECTION_DEADLINE, early_exit_load)
+
+    entries = {name: _node_metrics[name] for name in nodes if name in _node_metrics}
+    _metrics_snapshot = {name: metrics for name, (_, metrics) in entries.items()}
+    eligible = [(name, metrics) for name, metrics in _metrics_snapshot.items() if metrics.ram_usage < state.RAM_THRESHOLD]
+    # The policies only ever take one end of the ranking: two linear scans instead of a sort.
+    _eligible_extremes = (
+        min(eligible, key=_cpu_usage), max(reversed(eligible), key=_cpu_usage)
+    ) if eligible else ()
+    _load_vector = None
+    _snapshot_nodes = nodes
+    _snapshot_expires_at = min((fetched_at for fetched_at, _ in entries.values()), default=float('-inf')) + state.METRICS_CACHE_TTL
+    return _metrics_snapshot
+
+def invalidate_node_metrics(node_name: str):
+    """Forgets the cached metrics of a node that was (re-)registered or unregistered."""
+    global _snapshot_nodes, _snapshot_expires_at
+    _node_metrics.pop(node_name, None)
+    _snapshot_nodes = None
+    _snapshot_expires_at = float('-inf')
+
+def eligible_extremes() -> Tuple[Tuple[str, NodeMetrics], ...]:
+    """
+    The (least used, most used) nodes by CPU usage among those of the last metrics
+    snapshot below RAM_THRESHOLD, or () when none is. Computed once per snapshot.
+    """
+    return _eligible_extremes
+
+def cached_node_metrics(node_name: str) -> Optional[NodeMetrics]:
+    """The node's cached metrics if they are no older than METRICS_STALE_MAX_AGE, without probing."""
+    entry = _node_metrics.get(node_name)
+    if entry is None or time.monotonic() - entry[0] > state.METRICS_STALE_MAX_AGE:
+        return None
+    return entry[1]
+
+def least_loaded_cached(node_names) -> str:
+    """
+    The node with the lowest cached load among node_names, without probing. Nodes with
+    no cached metrics rank last, so with an empty cache this is simply the first name.
+    """
+    def cached_load(name):
+        entry = _node_metrics.get(name)
+        return entry[1].load if entry else float('inf')
+    return min(node_names, key=cached_load)
+
+def node_load_vector() -> Tuple[Tuple[str, float], ...]:
+    """(node, load) pairs from the last metrics snapshot, least loaded first."""
+    global _load_vector
+    if _load_vector is None:
+        _load_vector = tuple(sorted(
+            ((name, metrics.load) for name, metrics in _metrics_snapshot.items()),
+            key=lambda item: item[1]
+        ))
+    return _load_vector
+
+async def refresh_metrics_periodically():
+    """Keeps the cache warm so that scheduling rarely waits on SSH. The jitter spreads the probes over time."""
+    while True:
+        await asyncio.sleep(state.METRICS_REFRESH_INTERVAL + random.uniform(0, state.METRICS_REFRESH_JITTER))
+        try:
+            await refresh_node_metrics(state.node_registry, state.METRICS_REFRESH_INTERVAL)
+        except Exception as e:
+            logger.warning("Background metrics refresh failed: %s", e)
@@ -1,17 +1,51 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 from dataclasses import dataclass
+from typing import NamedTuple, Optional
 
 class RegisterFunctionRequest(BaseModel):
+    model_config = ConfigDict(extra='forbid', frozen=True)
+
     name: str
     image: str
     command: str
 
 class RegisterNodeRequest(BaseModel):
+    model_config = ConfigDict(extra='forbid', frozen=True)
+
     name: str
     host: str
     port: int = 22
     username: str
-    password: str
+    password: Optional[str] = None
+    private_key: Optional[str] = None
+    private_key_path: Optional[str] = None
+
+class FunctionView(BaseModel):
+    """What GET /functions exposes about a registered function."""
+    image: str
+    command: str
+
+class NodeView(BaseModel):
+    """What GET /nodes exposes about a node: connection details, never its secrets."""
+    name: str
+    host: str
+    port: int
+    username: str
+    private_key_path: Optional[str] = None
+
+class FunctionRecord(NamedTuple):
+    """A registered function, with its docker command lines pre-quoted at registration time."""
+    image: str
+    command: str
+    quoted_image: str
+    exec_suffix: str
+    run_prefix: str
+    run_suffix: str
+
+class NodeMetrics(NamedTuple):
+    cpu_usage: float
+    ram_usage: float
+    load: float
 
 @dataclass(frozen=True)
 class Mode:
@@ -1,28 +1,226 @@
-from typing import Dict, Any, Optional
-import json
+from typing import Dict, Any, List, Optional, Sequence, Set, Tuple, Union
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from functools import lru_cache
+import asyncio
+import os
+import re
+import shlex
+import socket
+import time
 import asyncssh
+import orjson
 
 import state
-from models import EXECUTION_MODES
+from log_config import logger
+from models import FunctionRecord, NodeMetrics
 
-async def run_ssh_command(node_info: Dict[str, Any], command: str) -> str:
+PoolKey = Tuple[str, int, str]
+# (endpoint, slot): the slot-th pooled connection to an SSH endpoint.
+ConnKey = Tuple[PoolKey, int]
+
+ssh_pool: Dict[ConnKey, asyncssh.SSHClientConnection] = {}
+pool_locks: Dict[ConnKey, asyncio.Lock] = defaultdict(asyncio.Lock)
+_pool_created_at: Dict[ConnKey, float] = {}
+_pool_last_used: Dict[ConnKey, float] = {}
+_pool_in_use: Dict[ConnKey, int] = defaultdict(int)
+# Connections of unregistered endpoints that still had sessions open: the reaper closes them once idle.
+_pool_retired: Set[ConnKey] = set()
+event_watchers: Dict[str, asyncio.Task] = {}
+_connect_options: Dict[str, asyncssh.SSHClientConnectionOptions] = {}
+_warming_inflight: Dict[Tuple[str, str, str], asyncio.Task] = {}
+# Warmed container starts in flight, keyed like state.container_pool by (node, image).
+_container_starts: Dict[Tuple[str, str], asyncio.Task] = {}
+# Characters of an image reference that are not allowed in a container name.
+_CONTAINER_NAME_UNSAFE = re.compile(r"[^a-zA-Z0-9_.-]")
+# Background `docker rmi` after cold runs, keyed by image only: nodes may share one Docker daemon
+# (docker-compose.yml mounts the host's socket into every node). Bounded like the other fan-outs.
+_image_removals: Dict[str, asyncio.Task] = {}
+_image_removal_semaphore = asyncio.Semaphore(state.SSH_FANOUT_LIMIT)
+_connect_semaphore = asyncio.Semaphore(state.SSH_FANOUT_LIMIT)
+# Caps the channels opened at once on each pooled connection below the nodes' sshd MaxSessions.
+_endpoint_semaphores: Dict[PoolKey, asyncio.Semaphore] = defaultdict(
+    lambda: asyncio.Semaphore(state.SSH_MAX_SESSIONS * state.SSH_CONNECTIONS_PER_ENDPOINT)
+)
+_slot_sessions: Dict[ConnKey, int] = defaultdict(int)
+
+def pool_key(node_info: Dict[str, Any]) -> PoolKey:
+    return (node_info["host"], node_info["port"], node_info["username"])
+
+def group_nodes_by_endpoint(nodes: Dict[str, Any]) -> Dict[PoolKey, List[str]]:
+    """Groups node names that share the same SSH endpoint (and therefore the same pooled connection)."""
+    groups: Dict[PoolKey, List[str]] = defaultdict(list)
+    for name, info in nodes.items():
+        groups[pool_key(info)].append(name)
+    return groups
+
+@lru_cache(maxsize=None)
+def _import_private_key(private_key: str) -> asyncssh.SSHKey:
+    return asyncssh.import_private_key(private_key)
+
+@lru_cache(maxsize=None)
+def _read_private_key(path: str) -> asyncssh.SSHKey:
+    return asyncssh.read_private_key(path)
+
+@lru_cache(maxsize=1)
+def _load_known_hosts() -> Optional[asyncssh.SSHKnownHosts]:
+    """Parses the known_hosts file once. Without one, host-key checking stays disabled."""
+    if state.KNOWN_HOSTS_PATH and os.path.exists(state.KNOWN_HOSTS_PATH):
+        return asyncssh.read_known_hosts(state.KNOWN_HOSTS_PATH)
+    return None
+
+def _credentials(node_info: Dict[str, Any]) -> Dict[str, Any]:
+    """Prefers public-key auth over password auth when the node was registered with a key."""
+    secrets = state.node_secrets.get(node_info["name"], {})
+    if secrets.get("private_key"):
+        return {"client_keys": [_import_private_key(secrets["private_key"])]}
+    if node_info.get("private_key_path"):
+        return {"client_keys": [_read_private_key(node_info["private_key_path"])]}
+    return {"password": secrets.get("password")}
+
+def _connection_options(node_info: Dict[str, Any]) -> asyncssh.SSHClientConnectionOptions:
+    """Builds the node's connection options once, so reconnects skip re-validating every option."""
+    options = _connect_options.get(node_info["name"])
+    if options is None:
+        options = asyncssh.SSHClientConnectionOptions(
+            username=node_info["username"],
+            known_hosts=_load_known_hosts(),
+            tcp_keepalive=True,
+            keepalive_interval=state.SSH_KEEPALIVE_INTERVAL,
+            keepalive_count_max=state.SSH_KEEPALIVE_COUNT_MAX,
+            compression_algs=state.SSH_COMPRESSION_ALGS,
+            encryption_algs=state.SSH_ENCRYPTION_ALGS,
+            **_credentials(node_info)
+        )
+        _connect_options[node_info["name"]] = options
+    return options
+
+def _set_tcp_nodelay(conn: asyncssh.SSHClientConnection):
+    """Disables Nagle's algorithm so short command/response exchanges are not delayed."""
+    sock = conn.get_extra_info('socket')
+    if sock is None:
+        return
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    except OSError as e:
+        logger.warning("Unable to set TCP_NODELAY on the SSH socket: %s", e)
+
+async def _get_connection(node_info: Dict[str, Any], slot: int = 0) -> asyncssh.SSHClientConnection:
+    """Returns the node's slot-th pooled connection, opening a new one if missing or closed."""
+    key = (pool_key(node_info), slot)
+    # Fast path without the lock: only a missing or closed connection needs to be (re)opened under it.
+    conn = ssh_pool.get(key)
+    if conn is not None and not conn.is_closed():
+        _pool_last_used[key] = time.monotonic()
+        return conn
+    async with pool_locks[key]:
+        conn = ssh_pool.get(key)
+        if conn is None or conn.is_closed():
+            # Bounds concurrent handshakes, so a burst of reconnects stays below the nodes' sshd MaxStartups.
+            async with _connect_semaphore:
+                conn = await asyncssh.connect(
+                    node_info["host"], node_info["port"], options=_connection_options(node_info)
+                )
+            _set_tcp_nodelay(conn)
+            ssh_pool[key] = conn
+            _pool_created_at[key] = time.monotonic()
+        _pool_last_used[key] = time.monotonic()
+        return conn
+
+async def connect_node(node_info: Dict[str, Any]):
+    """Opens the node's pooled connection ahead of its first command. Failures are only logged."""
+    try:
+        await _get_connection(node_info)
+    except Exception as e:
+        logger.warning("Unable to pre-connect to node '%s': %s", node_info["name"], e)
+
+def _drop_connection(key: ConnKey, conn: Optional[asyncssh.SSHClientConnection] = None):
+    """Evicts a pooled connection. If conn is given, only evicts it if it is still the pooled one."""
+    if conn is not None and ssh_pool.get(key) is not conn:
+        return
+    pooled = ssh_pool.pop(key, None)
+    _pool_retired.discard(key)
+    _pool_created_at.pop(key, None)
+    _pool_last_used.pop(key, None)
+    if pooled is not None:
+        pooled.close()
+
+@asynccontextmanager
+async def _pooled_session(node_info: Dict[str, Any]):
+    """
+    Reserves one session on the node's endpoint and yields the slot of the connection to
+    open it on. Slots are filled in order, so the extra connections only open under load
+    and go idle, and get reaped, once it passes.
+    """
+    endpoint = pool_key(node_info)
+    async with _endpoint_semaphores[endpoint]:
+        # The endpoint semaphore guarantees that some slot has a free session.
+        slot = next(
+            slot for slot in range(state.SSH_CONNECTIONS_PER_ENDPOINT)
+            if _slot_sessions[(endpoint, slot)] < state.SSH_MAX_SESSIONS
+        )
+        key = (endpoint, slot)
+        _slot_sessions[key] += 1
+        _pool_in_use[key] += 1
+        try:
+            yield slot
+        finally:
+            _slot_sessions[key] -= 1
+            _pool_in_use[key] -= 1
+            _pool_last_used[key] = time.monotonic()
+
+async def _run_on_pooled_connection(node_info: Dict[str, Any], command: str, timeout: float, retry: bool) -> asyncssh.SSHCompletedProcess:
+    async with _pooled_session(node_info) as slot:
+        return await _run_with_reconnect(slot, node_info, command, timeout, retry)
+
+async def _run_once(key: ConnKey, node_info: Dict[str, Any], command: str, timeout: float) -> asyncssh.SSHCompletedProcess:
+    conn = await _get_connection(node_info, key[1])
+    try:
+        result = await conn.run(command, check=True, timeout=timeout)
+    except asyncssh.DisconnectError:
+        # Only a lost connection is evicted: it is already closed for every session on it.
+        _drop_connection(key, conn)
+        raise
+    if result.exit_status is None:
+        # The channel closed without reporting an exit status: the command did not finish.
+        if conn.is_closed():
+            _drop_connection(key, conn)
+        raise asyncssh.ConnectionLost("The channel closed before the command exited.")
+    return result
+
+async def _run_with_reconnect(slot: int, node_info: Dict[str, Any], command: str, timeout: float, retry: bool) -> asyncssh.SSHCompletedProcess:
+    key = (pool_key(node_info), slot)
+    try:
+        return await _run_once(key, node_info, command, timeout)
+    except asyncssh.DisconnectError:
+        # The command may already have run on the node: only idempotent ones are re-run.
+        if not retry:
+            raise
+        return await _run_once(key, node_info, command, timeout)
+
+async def run_ssh_command(node_info: Dict[str, Any], command: Union[str, Sequence[str]], timeout: Optional[float] = None, retry: bool = True) -> str:
     """
-    Connects to a node via SSH, executes a command, and checks the outcome.
+    Executes a command on a node over its pooled SSH connection and checks the outcome.
+    An argv list is quoted with shlex.join, so its arguments never need manual escaping.
+    With retry, a command cut off by a lost connection is run once more on a new one;
+    pass retry=False for commands that must not run twice.
     """
+    if not isinstance(command, str):
+        command = shlex.join(command)
+    if timeout is None:
+        timeout = state.SSH_COMMAND_TIMEOUT
     try:
-        async with asyncssh.connect(
-            host=node_info["host"],
-            port=node_info["port"],
-            username=node_info["username"],
-            password=node_info["password"],
-            known_hosts=None
-        ) as conn:
-            result = await conn.run(command, check=True)
-            return result.stdout.strip()
-            
+        result = await _run_on_pooled_connection(node_info, command, timeout, retry)
+        return result.stdout.strip()
+
+    except asyncssh.TimeoutError as e:
+        raise Exception(
+            f"The command on node '{node_info['host']}' timed out after {timeout} seconds.\n"
+            f"Stderr: {(e.stderr or '').strip()}"
+        )
     except asyncssh.ProcessError as e:
         raise Exception(
-            f"The command on node '{node_info['host']}' failed with exit code {e.returncode}.n"
+            f"The command on node '{node_info['host']}' failed with exit code {e.returncode}.\n"
             f"Stderr: {e.stderr.strip()}"
         )
     except asyncssh.Error as e:
@@ -30,52 +228,354 @@ async def run_ssh_command(node_info: Dict[str, Any], command: str) -> str:
     except Exception as e:
         raise Exception(f"Unexpected error during SSH execution: {e}")
 
-async def get_metrics_for_node(node_name: str, node_info: Dict[str, Any]) -> Optional[Dict[str, float]]:
+async def _docker_api_request(node_info: Dict[str, Any], method: str, path: str) -> int:
+    """
+    Sends one request to the node's Docker Engine API over a unix-socket channel of the
+    pooled SSH connection and returns the HTTP status, sparing the docker CLI start-up.
+    """
+    async with _pooled_session(node_info) as slot:
+        conn = await _get_connection(node_info, slot)
+        reader, writer = await conn.open_unix_connection(state.DOCKER_SOCKET_PATH, encoding=None)
+        try:
+            writer.write(f"{method} {path} HTTP/1.0\r\nHost: docker\r\n\r\n".encode())
+            status_line = await asyncio.wait_for(reader.readline(), timeout=state.SSH_COMMAND_TIMEOUT)
+        finally:
+            writer.close()
+    parts = status_line.split()
+    if len(parts) < 2 or not parts[1].isdigit():
+        raise Exception(f"Unexpected Docker API response from node '{node_info['host']}': {status_line!r}")
+    return int(parts[1])
+
+async def remove_containers(node_info: Dict[str, Any], container_ids: Sequence[str]):
+    """
+    Force-removes containers through the Docker API, one concurrent request each. Falls back
+    to `docker rm -f` when the node does not allow unix-socket forwarding over SSH.
+    """
+    try:
+        statuses = await asyncio.gather(*(
+            _docker_api_request(node_info, "DELETE", f"/containers/{container_id}?force=true")
+            for container_id in container_ids
+        ))
+    except asyncssh.ChannelOpenError as e:
+        logger.debug("Docker API not reachable on '%s' (%s): using the docker CLI.", node_info["host"], e)
+        await run_ssh_command(node_info, ["docker", "rm", "-f", *container_ids])
+        return
+    # 404: the container is already gone, which is what was asked.
+    failed = [cid for cid, status in zip(container_ids, statuses) if status not in (204, 404)]
+    if failed:
+        raise Exception(f"Docker refused to remove {failed} on node '{node_info['host']}'.")
+
+async def reap_idle_connections():
+    """
+    Periodically closes pooled connections that are idle for too long, older than the
+    max age, or retired by release_node, as long as no session is using them.
+    """
+    while True:
+        await asyncio.sleep(state.SSH_REAPER_INTERVAL)
+        now = time.monotonic()
+        for key in list(ssh_pool):
+            if _pool_in_use[key]:
+                continue
+            idle = now - _pool_last_used.get(key, now)
+            age = now - _pool_created_at.get(key, now)
+            if key in _pool_retired or idle > state.SSH_IDLE_TIMEOUT or age > state.SSH_MAX_AGE:
+                _drop_connection(key)
+
+async def close_all_connections():
+    """Closes every pooled SSH connection."""
+    connections = list(ssh_pool.values())
+    for key in list(ssh_pool):
+        _drop_connection(key)
+    await asyncio.gather(*(conn.wait_closed() for conn in connections), return_exceptions=True)
+
+async def get_metrics_for_node(node_name: str, node_info: Dict[str, Any]) -> Optional[NodeMetrics]:
     """Retrieves and parses CPU and RAM metrics for a single node."""
     try:
         metrics_json = await run_ssh_command(node_info, "/usr/local/bin/get_node_metrics.sh")
-        metrics = json.loads(metrics_json)
-        return {
-            "cpu_usage": float(metrics.get("cpu_usage", float('inf'))),
-            "ram_usage": float(metrics.get("ram_usage", float('inf'))),
-        }
+        metrics = orjson.loads(metrics_json)
+        cpu_usage = float(metrics.get("cpu_usage", float('inf')))
+        ram_usage = float(metrics.get("ram_usage", float('inf')))
+        # Nodes running an older metrics script do not report the combined load.
+        load = float(metrics["load"]) if "load" in metrics else (cpu_usage + ram_usage) / 2
+        return NodeMetrics(cpu_usage=cpu_usage, ram_usage=ram_usage, load=load)
     except Exception as e:
-        print(f"Warning: Unable to retrieve metrics for '{node_name}': {e}. Ignored.")
+        logger.warning("Unable to retrieve metrics for '%s': %s. Ignored.", node_name, e)
         return None
 
+def build_function_record(function_name: str, image: str, command: str) -> FunctionRecord:
+    """
+    Shell-quotes the image and command once, at registration, and stores the
+    invariant heads and tails of the docker command lines, so invocations only add
+    the container name suffix. Raises ValueError if the command cannot be parsed.
+    """
+    quoted_image = shlex.quote(image)
+    quoted_command = shlex.join(shlex.split(command))
+    container_prefix = f"{state.CONTAINER_PREFIX}{function_name}--"
+    run_suffix = f" {quoted_image} {quoted_command}"
+    return FunctionRecord(
+        image=image,
+        command=command,
+        quoted_image=quoted_image,
+        exec_suffix=f" {quoted_command}",
+        # Invocations append a hex id, which never needs quoting, right after the quoted prefix.
+        run_prefix="docker run --rm --name " + shlex.quote(container_prefix),
+        run_suffix=run_suffix,
+    )
+
+async def _remove_image(node_name: str, node_info: Dict[str, Any], function_details: FunctionRecord, previous: Optional[asyncio.Task]):
+    if previous is not None:
+        await asyncio.wait([previous])
+    async with _image_removal_semaphore:
+        try:
+            await run_ssh_command(node_info, "docker rmi " + function_details.quoted_image)
+        except Exception as e:
+            logger.warning("Unable to remove image from node '%s': %s", node_name, e)
+
+def schedule_image_removal(node_name: str, node_info: Dict[str, Any], function_details: FunctionRecord):
+    """
+    Removes the image of a finished cold run in the background, off the invocation's response path.
+    A removal of the same image still pending is chained in front, so the latest task covers both.
+    """
+    image = function_details.image
+    task = asyncio.create_task(_remove_image(node_name, node_info, function_details, _image_removals.get(image)))
+    _image_removals[image] = task
+
+    def forget(done: asyncio.Task):
+        if _image_removals.get(image) is done:
+            del _image_removals[image]
+    task.add_done_callback(forget)
+
+async def wait_for_image_removal(image: str):
+    """
+    Waits for a pending removal of image on any node, so that the next cold run really
+    starts without the image instead of racing the previous cleanup on a shared daemon.
+    """
+    task = _image_removals.get(image)
+    if task is not None:
+        await asyncio.wait([task])
+
+async def drain_image_removals():
+    """Waits for every pending image removal."""
+    if _image_removals:
+        await asyncio.wait(list(_image_removals.values()))
+
+def _is_registered(node_name: str, node_info: Dict[str, Any]) -> bool:
+    """False once node_name was unregistered (or replaced by a new registration) after node_info was read."""
+    return state.node_registry.get(node_name) is node_info
+
+async def _join_warming(kind: str, function_name: str, node_name: str, prepare):
+    """Runs prepare(function_name, node_name), or joins the identical one already in flight."""
+    key = (kind, function_name, node_name)
+    task = _warming_inflight.get(key)
+    if task is None:
+        task = asyncio.create_task(prepare(function_name, node_name))
+        _warming_inflight[key] = task
+        task.add_done_callback(lambda _: _warming_inflight.pop(key, None))
+    # Unlike awaiting the task, wait does not cancel the shared warm-up if this caller is cancelled.
+    await asyncio.wait([task])
+
 async def prewarm_function_on_node(function_name: str, node_name: str):
     """Performs a docker pull on node_name and updates the status to pre-warmed."""
-    if function_name not in state.function_registry or node_name not in state.node_registry:
-        return
+    await _join_warming("pre-warm", function_name, node_name, _prewarm_function_on_node)
 
-    node_info = state.node_registry[node_name]
-    docker_image = state.function_registry[function_name]["image"]
+async def _prewarm_function_on_node(function_name: str, node_name: str):
+    function_details = state.function_registry.get(function_name)
+    node_info = state.node_registry.get(node_name)
+    if function_details is None or node_info is None:
+        return
 
     try:
-        await run_ssh_command(node_info, f"sudo docker pull {docker_image}")
-        
-        if function_name not in state.function_state_registry:
-            state.function_state_registry[function_name] = {}
-        state.function_state_registry[function_name][node_name] = EXECUTION_MODES.PRE_WARMED.value
+        await run_ssh_command(node_info, ["docker", "pull", function_details.image])
+        if not _is_registered(node_name, node_info):
+            return
+        state.mark_prewarmed(function_name, node_name)
     except Exception as e:
-        print(f"Error during pre-warm of '{function_name}' on '{node_name}': {e}")
+        logger.error("Error during pre-warm of '%s' on '%s': %s", function_name, node_name, e)
+
+
+def touch_pooled_container(node_name: str, image: str) -> Optional[str]:
+    """Returns the warmed container id for (node_name, image), marking it as most recently used."""
+    key = (node_name, image)
+    container_id = state.container_pool.get(key)
+    if container_id is not None:
+        state.container_pool.move_to_end(key)
+    return container_id
+
+def _demote_warmed_functions(node_name: str, images):
+    """Marks the functions using one of images as pre-warmed on node_name once their container is gone."""
+    for function_name, details in state.function_registry.items():
+        if details.image in images and node_name in state.warmed_nodes.get(function_name, ()):
+            state.mark_prewarmed(function_name, node_name)
+
+async def _evict_lru_containers(node_name: str, node_info: Dict[str, Any]):
+    """
+    Removes the least recently used warmed containers of node_name until one more fits
+    under MAX_WARM_CONTAINERS_PER_NODE. Their functions fall back to pre-warmed, since
+    the image is still on the node.
+    """
+    pooled = [key for key in state.container_pool if key[0] == node_name]
+    evicted = pooled[:max(0, len(pooled) - state.MAX_WARM_CONTAINERS_PER_NODE + 1)]
+    if not evicted:
+        return
+
+    container_ids = [state.container_pool.pop(key) for key in evicted]
+    _demote_warmed_functions(node_name, {image for _, image in evicted})
 
+    try:
+        await remove_containers(node_info, container_ids)
+    except Exception as e:
+        logger.error("Error while evicting warmed containers from '%s': %s", node_name, e)
 
 async def warmup_function_on_node(function_name: str, node_name: str):
     """Start a container in the background on node_name and update the status to warmed"""
-    if function_name not in state.function_registry or node_name not in state.node_registry:
-        return
+    await _join_warming("warm-up", function_name, node_name, _warmup_function_on_node)
+
+def warm_container_name(node_name: str, image: str) -> str:
+    """The name of the warmed container shared by every function using image on node_name."""
+    return f"{state.CONTAINER_PREFIX}warm--{_CONTAINER_NAME_UNSAFE.sub('-', image)}--{node_name}"
+
+async def _start_pooled_container(node_name: str, node_info: Dict[str, Any], image: str) -> str:
+    await _evict_lru_containers(node_name, node_info)
+    container_name = warm_container_name(node_name, image)
+    # A leftover container with the same name would make docker run fail: remove it in the same round-trip.
+    docker_cmd = (
+        shlex.join(["docker", "rm", "-f", container_name]) + " >/dev/null 2>&1; "
+        + shlex.join(["docker", "run", "-d", "--name", container_name, "--entrypoint", "sleep", image, "infinity"])
+    )
+    container_id = await run_ssh_command(node_info, docker_cmd)
+    if not _is_registered(node_name, node_info):
+        # The node was unregistered while the container started: release_node has already run.
+        try:
+            await remove_containers(node_info, [container_id])
+        except Exception as e:
+            logger.error("Error while removing the warmed container of unregistered node '%s': %s", node_name, e)
+        return None
+    state.container_pool[(node_name, image)] = container_id
+    _ensure_event_watcher(node_name, node_info)
+    return container_id
 
-    node_info = state.node_registry[node_name]
-    docker_image = state.function_registry[function_name]["image"]
-    container_name = f"{state.CONTAINER_PREFIX}{function_name}--{node_name}"
+async def _pooled_container(node_name: str, node_info: Dict[str, Any], image: str) -> Optional[str]:
+    """
+    Returns the warmed container of image on node_name, starting it if missing, or None if
+    the node was unregistered meanwhile. Functions warming up concurrently with the same
+    image share one start, hence one container.
+    """
+    key = (node_name, image)
+    container_id = state.container_pool.get(key)
+    if container_id is not None:
+        state.container_pool.move_to_end(key)
+        return container_id
+    task = _container_starts.get(key)
+    if task is None:
+        task = asyncio.create_task(_start_pooled_container(node_name, node_info, image))
+        _container_starts[key] = task
+        task.add_done_callback(lambda _: _container_starts.pop(key, None))
+    # As in _join_warming, a cancelled caller must not cancel the start shared with the others.
+    await asyncio.wait([task])
+    return task.result()
+
+async def _warmup_function_on_node(function_name: str, node_name: str):
+    function_details = state.function_registry.get(function_name)
+    node_info = state.node_registry.get(node_name)
+    if function_details is None or node_info is None:
+        return
 
     try:
-        docker_cmd = f"sudo docker run -d --name {container_name} {docker_image} sleep infinity"
-        await run_ssh_command(node_info, docker_cmd)
-        
-        if function_name not in state.function_state_registry:
-            state.function_state_registry[function_name] = {}
-        state.function_state_registry[function_name][node_name] = EXECUTION_MODES.WARMED.value
+        container_id = await _pooled_container(node_name, node_info, function_details.image)
+        if container_id is None or not _is_registered(node_name, node_info):
+            return
+        state.mark_warmed(function_name, node_name, "docker exec " + shlex.quote(container_id) + function_details.exec_suffix)
     except Exception as e:
-        print(f"Error during warm-up of '{function_name}' on '{node_name}': {e}")
\ No newline at end of file
+        logger.error("Error during warm-up of '%s' on '%s': %s", function_name, node_name, e)
+
+def _on_container_died(node_name: str, container_id: str):
+    """Drops a warmed container that exited on its own and demotes its functions to pre-warmed."""
+    for key, pooled_id in list(state.container_pool.items()):
+        if key[0] == node_name and pooled_id == container_id:
+            del state.container_pool[key]
+            _demote_warmed_functions(node_name, {key[1]})
+            logger.warning("The warmed container of '%s' on '%s' exited. Falling back to pre-warmed.", key[1], node_name)
+
+async def _watch_container_events(node_name: str, node_info: Dict[str, Any]):
+    """
+    Follows the docker event stream of a node, so that the warm state stays in sync
+    with the containers actually running without probing them on every invocation.
+    """
+    command = shlex.join(["docker", "events", "--filter", "type=container", "--filter", "event=die", "--format", "{{.Actor.ID}}"])
+    # The stream stays on the first connection, in the session left free by SSH_MAX_SESSIONS.
+    key = (pool_key(node_info), 0)
+    while True:
+        _pool_in_use[key] += 1
+        try:
+            conn = await _get_connection(node_info)
+            async with conn.create_process(command) as process:
+                async for line in process.stdout:
+                    _on_container_died(node_name, line.strip())
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("Docker event stream of '%s' interrupted: %s", node_name, e)
+        finally:
+            _pool_in_use[key] -= 1
+        await asyncio.sleep(state.DOCKER_EVENTS_RETRY_INTERVAL)
+
+def _ensure_event_watcher(node_name: str, node_info: Dict[str, Any]):
+    """Starts the node's docker event watcher the first time a container is warmed on it."""
+    task = event_watchers.get(node_name)
+    if task is None or task.done():
+        event_watchers[node_name] = asyncio.create_task(_watch_container_events(node_name, node_info))
+
+async def stop_event_watchers():
+    """Cancels every docker event watcher."""
+    tasks = list(event_watchers.values())
+    event_watchers.clear()
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+async def remove_pooled_containers():
+    """Force-removes every warmed container recorded in the container pool."""
+    tasks = []
+    for (node_name, _), container_id in list(state.container_pool.items()):
+        node_info = state.node_registry.get(node_name)
+        if node_info:
+            tasks.append(remove_containers(node_info, [container_id]))
+    state.container_pool.clear()
+    state.warm_commands.clear()
+
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    for result in results:
+        if isinstance(result, Exception):
+            logger.error("Error while removing a warmed container: %s", result)
+
+async def release_node(node_name: str, node_info: Dict[str, Any]):
+    """
+    Cleans up after an unregistered node: stops its event watcher, removes its warmed
+    containers, forgets its warm state and closes its pooled SSH connections unless another node shares them.
+    Connections with commands still running are left to the reaper, which closes them once idle.
+    """
+    watcher = event_watchers.pop(node_name, None)
+    if watcher is not None:
+        watcher.cancel()
+    container_ids = [cid for (name, _), cid in state.container_pool.items() if name == node_name]
+    for key in [key for key in state.container_pool if key[0] == node_name]:
+        del state.container_pool[key]
+    state.forget_warm_state(node_name)
+
+    if container_ids:
+        try:
+            await remove_containers(node_info, container_ids)
+        except Exception as e:
+            logger.error("Error while removing the warmed containers of '%s': %s", node_name, e)
+
+    endpoint = pool_key(node_info)
+    if all(pool_key(info) != endpoint for info in state.node_registry.values()):
+        for slot in range(state.SSH_CONNECTIONS_PER_ENDPOINT):
+            key = (endpoint, slot)
+            # Closing a connection under an in-flight command would end it without an exit status.
+            if _pool_in_use[key]:
+                _pool_retired.add(key)
+            else:
+                _drop_connection(key)
+    _connect_options.pop(node_name, None)
+    state.forget_node_secrets(node_name)
@@ -1,138 +1,250 @@
 from typing import Dict, Any, Optional
-import itertools
+from functools import lru_cache
 import asyncio
+import random
 from fastapi import HTTPException
 
 import state
-from models import EXECUTION_MODES
-from node_manager import get_metrics_for_node, prewarm_function_on_node, warmup_function_on_node
-
+from log_config import logger
+from models import EXECUTION_MODES, NodeMetrics
+from metrics_cache import cached_node_metrics, get_all_node_metrics, get_node_metrics, eligible_extremes, least_loaded_cached
+from node_manager import prewarm_function_on_node, warmup_function_on_node
+
+
+@lru_cache(maxsize=None)
+def _cold_mode_label(policy_label: str) -> str:
+    """The "Execution Mode" column of a cold invocation, formatted once per policy."""
+    return f"{policy_label} - {EXECUTION_MODES.COLD.label}"
+
+def _metric_entry(function_name: str, node_name: str, metrics: NodeMetrics, policy_label: str) -> Dict[str, Any]:
+    """The metrics row recorded for a cold invocation scheduled by a node selection policy."""
+    return {
+        "Function": function_name, "Node": node_name,
+        "CPU Usage %": metrics.cpu_usage, "RAM Usage %": metrics.ram_usage,
+        "Execution Mode": _cold_mode_label(policy_label)
+    }
+
+def _unprobed_metric_entry(function_name: str, node_name: str, policy_label: str) -> Dict[str, Any]:
+    """The metrics row for a node selected without reading its metrics."""
+    return {
+        "Function": function_name, "Node": node_name, "CPU Usage %": "---", "RAM Usage %": "---",
+        "Execution Mode": _cold_mode_label(policy_label)
+    }
+
+async def _select_single_node(function_name: str, node_name: str, node_info: Dict[str, Any], policy_label: str) -> tuple:
+    """
+    Selects the only registered node, reusing its cached metrics when there are any and
+    probing it only on a cache miss, since no periodic refresh may be filling the cache.
+    Metrics above RAM_THRESHOLD rule the node out; if the probe fails it is used unprobed.
+    """
+    metrics = cached_node_metrics(node_name)
+    if metrics is None:
+        metrics = await get_node_metrics(node_name, node_info)
+    if metrics is None:
+        return node_name, _unprobed_metric_entry(function_name, node_name, policy_label)
+    if metrics.ram_usage >= state.RAM_THRESHOLD:
+        logger.warning("%s: Node '%s' discarded because RAM > %s%%.", policy_label, node_name, state.RAM_THRESHOLD)
+        return None, None
+    return node_name, _metric_entry(function_name, node_name, metrics, policy_label)
 
 class RoundRobinPolicy:
+    """
+    Cycles through the nodes in registration order with a modular index over the
+    node_items snapshot, skipping nodes above RAM_THRESHOLD. The snapshot is only
+    re-read when node_registry_version changes, so a stable cluster costs no allocation.
+    """
     def __init__(self):
-        self.node_iterator = itertools.cycle([])
-        self._nodes_cache = []
+        self._nodes_cache = ()
+        self._seen_version = -1
+        self._index = -1
+
+    def _resume_index(self, new_nodes) -> int:
+        """
+        Index in new_nodes of the last selected node, or of the closest node before it
+        that is still registered, so the rotation carries on where it left off.
+        """
+        positions = {name: i for i, (name, _) in enumerate(new_nodes)}
+        old_nodes = self._nodes_cache
+        if self._index < 0:
+            return -1
+        for offset in range(len(old_nodes)):
+            name = old_nodes[(self._index - offset) % len(old_nodes)][0]
+            if name in positions:
+                return positions[name]
+        return -1
 
     async def select_node(self, nodes: Dict[str, Any], function_name: str) -> Optional[tuple]:
         if not nodes:
             return None, None
         
-        current_node_names = sorted(list(nodes.keys()))
-        if current_node_names != self._nodes_cache:
-            self._nodes_cache = current_node_names
-            self.node_iterator = itertools.cycle(current_node_names)
+        # The (name, info) snapshot is only picked up when the registry has changed since the last call.
+        if state.node_registry_version != self._seen_version:
+            new_nodes = state.node_items
+            self._index = self._resume_index(new_nodes)
+            self._nodes_cache = new_nodes
+            self._seen_version = state.node_registry_version
         
-        nodes_to_check = len(current_node_names)
+        nodes_to_check = len(self._nodes_cache)
         for _ in range(nodes_to_check):
-            try:
-                selected_node = next(self.node_iterator)
-                metrics = await get_metrics_for_node(selected_node, nodes[selected_node])
-
-                if metrics and metrics.get('ram_usage', 100.0) < state.RAM_THRESHOLD:
-                    cpu_usage = metrics.get('cpu_usage', 'N/A')
-                    ram_usage = metrics.get('ram_usage', 'N/A')
-                    metric_entry = {"Function": function_name, "Node": selected_node, "CPU Usage %": cpu_usage, "RAM Usage %": ram_usage, "Execution Mode": f"Round Robin - {EXECUTION_MODES.COLD.label}"}
-                    return selected_node, metric_entry
-                else:
-                    print(f"Warning (Round Robin): Node '{selected_node}' discarded because RAM > {state.RAM_THRESHOLD}%.")
-
-            except StopIteration:
-                return None, None
+            self._index = (self._index + 1) % nodes_to_check
+            selected_node, node_info = self._nodes_cache[self._index]
+            metrics = await get_node_metrics(selected_node, node_info)
+
+            if metrics and metrics.ram_usage < state.RAM_THRESHOLD:
+                return selected_node, _metric_entry(function_name, selected_node, metrics, "Round Robin")
+            else:
+                logger.warning("Round Robin: Node '%s' discarded because RAM > %s%%.", selected_node, state.RAM_THRESHOLD)
         
-        print("Warning (Round Robin): No nodes available with sufficient RAM.")
+        logger.warning("Round Robin: No nodes available with sufficient RAM.")
         return None, None
 
-class LeastUsedPolicy:
-    async def _get_all_node_metrics(self, nodes: Dict[str, Any]) -> Dict[str, Any]:
-        tasks = [get_metrics_for_node(name, info) for name, info in nodes.items()]
-        results = await asyncio.gather(*tasks)
-        return {name: metrics for name, metrics in zip(nodes.keys(), results) if metrics}
+class _RankedMetricsPolicy:
+    """Shared selection of the metric-based policies: picks one end (rank_index 0 or -1) of the current metrics ranking."""
+    uses_metrics_cache = True
+    label = ""
+    rank_index = 0
+    early_exit_load: Optional[float] = None
 
     async def select_node(self, nodes: Dict[str, Any], function_name: str) -> Optional[tuple]:
         if not nodes:
             return None, None
+        if len(nodes) == 1:
+            # There is nothing to rank: the node is only checked against RAM_THRESHOLD.
+            only_node, node_info = next(iter(nodes.items()))
+            return await _select_single_node(function_name, only_node, node_info, self.label)
         
-        all_node_metrics = await self._get_all_node_metrics(nodes)
+        all_node_metrics = await get_all_node_metrics(nodes, self.early_exit_load)
         if not all_node_metrics:
-            print("Least Used: Unable to retrieve metrics from any node.")
+            logger.warning("%s: Unable to retrieve metrics from any node.", self.label)
             return None, None
         
-        eligible_nodes = {
-            name: metrics for name, metrics in all_node_metrics.items()
-            if metrics.get('ram_usage', 100.0) < state.RAM_THRESHOLD
-        }
-
+        eligible_nodes = eligible_extremes()
         if not eligible_nodes:
-            print(f"Warning (Least Used): No nodes available with RAM < {state.RAM_THRESHOLD}%.")
+            logger.warning("%s: No nodes available with RAM < %s%%.", self.label, state.RAM_THRESHOLD)
             return None, None
 
-        selected_node = min(eligible_nodes, key=lambda n: eligible_nodes[n]["cpu_usage"])
-        
-        if selected_node:
-            metric_entry = {"Function": function_name, "Node": selected_node, "CPU Usage %": eligible_nodes[selected_node]['cpu_usage'], "RAM Usage %": eligible_nodes[selected_node]['ram_usage'], "Execution Mode": f"Least Used - {EXECUTION_MODES.COLD.label}"}
-            return selected_node, metric_entry
-        return None, None
+        selected_node, selected_metrics = eligible_nodes[self.rank_index]
+        return selected_node, _metric_entry(function_name, selected_node, selected_metrics, self.label)
+
+class LeastUsedPolicy(_RankedMetricsPolicy):
+    label = "Least Used"
+    rank_index = 0
+    # A clearly idle node is good enough; there is no need to wait for the slowest probe.
+    early_exit_load = state.METRICS_EARLY_EXIT_LOAD
+
+class MostUsedPolicy(_RankedMetricsPolicy):
+    label = "Most Used"
+    rank_index = -1
 
-class MostUsedPolicy:
-    async def _get_all_node_metrics(self, nodes: Dict[str, Any]) -> Dict[str, Any]:
-        tasks = [get_metrics_for_node(name, info) for name, info in nodes.items()]
-        results = await asyncio.gather(*tasks)
-        return {name: metrics for name, metrics in zip(nodes.keys(), results) if metrics}
+class PowerOfTwoChoicesPolicy:
+    """
+    Samples two random nodes and keeps the one with the lower CPU usage, so only two
+    nodes are probed per selection and concurrent invocations do not all herd onto
+    the single least used node. If neither sample is below RAM_THRESHOLD, two more are
+    drawn from the nodes not tried yet, until one is eligible or none are left.
+    """
+    label = "Power of Two Choices"
 
     async def select_node(self, nodes: Dict[str, Any], function_name: str) -> Optional[tuple]:
         if not nodes:
             return None, None
-        
-        all_node_metrics = await self._get_all_node_metrics(nodes)
-        if not all_node_metrics:
-            print("Most Used: Unable to retrieve metrics from any node.")
-            return None, None
-        
-        eligible_nodes = {
-            name: metrics for name, metrics in all_node_metrics.items()
-            if metrics.get('ram_usage', 100.0) < state.RAM_THRESHOLD
-        }
-
-        if not eligible_nodes:
-            print(f"Warning (Most Used): No nodes available with RAM < {state.RAM_THRESHOLD}%.")
-            return None, None
-
-        selected_node = max(eligible_nodes, key=lambda n: eligible_nodes[n]["cpu_usage"])
-        
-        if selected_node:
-            metric_entry = {"Function": function_name, "Node": selected_node, "CPU Usage %": eligible_nodes[selected_node]['cpu_usage'], "RAM Usage %": eligible_nodes[selected_node]['ram_usage'], "Execution Mode": f"Most Used - {EXECUTION_MODES.COLD.label}"}
-            return selected_node, metric_entry
+        if len(nodes) == 1:
+            only_node, node_info = next(iter(nodes.items()))
+            return await _select_single_node(function_name, only_node, node_info, self.label)
+
+        untried = list(state.node_items)
+        first_draw = True
+        while untried:
+            candidates = random.sample(untried, min(2, len(untried)))
+            for candidate in candidates:
+                untried.remove(candidate)
+            probed = await asyncio.gather(*(get_node_metrics(name, info) for name, info in candidates))
+            eligible = [
+                (name, metrics) for (name, _), metrics in zip(candidates, probed)
+                if metrics and metrics.ram_usage < state.RAM_THRESHOLD
+            ]
+            if eligible:
+                selected_node, selected_metrics = min(eligible, key=lambda item: item[1].cpu_usage)
+                return selected_node, _metric_entry(function_name, selected_node, selected_metrics, self.label)
+
+            if first_draw and not any(probed):
+                # Neither probe of the first draw answered: pick one of the samples blindly rather than failing the invocation.
+                selected_node = random.choice(candidates)[0]
+                logger.warning("%s: No metrics for the sampled nodes, picked '%s' at random.", self.label, selected_node)
+                return selected_node, _unprobed_metric_entry(function_name, selected_node, self.label)
+            first_draw = False
+
+        logger.warning("%s: No nodes available with RAM < %s%%.", self.label, state.RAM_THRESHOLD)
         return None, None
 
+_warming_semaphore = asyncio.Semaphore(state.SSH_FANOUT_LIMIT)
+
 class StaticWarmingPolicy:
     async def apply(self, warming_type: str, function_name: str, scheduler):
-        if warming_type == EXECUTION_MODES.PRE_WARMED.value:
+        if warming_type in (EXECUTION_MODES.PRE_WARMED.value, EXECUTION_MODES.WARMED.value):
             node_to_prepare, _ = await scheduler.select_node(state.node_registry, function_name)
-            if node_to_prepare: await prewarm_function_on_node(function_name, node_to_prepare)
+            if node_to_prepare: await self.apply_to_nodes(warming_type, function_name, [node_to_prepare])
+
+    async def apply_to_nodes(self, warming_type: str, function_name: str, node_names):
+        """Warms function_name on every given node concurrently, at most SSH_FANOUT_LIMIT at a time."""
+        if warming_type == EXECUTION_MODES.PRE_WARMED.value:
+            prepare = prewarm_function_on_node
         elif warming_type == EXECUTION_MODES.WARMED.value:
-            node_to_prepare, _ = await scheduler.select_node(state.node_registry, function_name)
-            if node_to_prepare: await warmup_function_on_node(function_name, node_to_prepare)
+            prepare = warmup_function_on_node
+        else:
+            return
 
-class WarmedFirstPolicy:
-    async def select_node(self, function_name: str, scheduler):
-        if function_name in state.function_state_registry:
-            for n, s in state.function_state_registry[function_name].items():
-                if s == EXECUTION_MODES.WARMED.value:
-                    return n, None, EXECUTION_MODES.WARMED.value
-        return await PreWarmedFirstPolicy().select_node(function_name, scheduler)
+        async def prepare_node(node_name):
+            async with _warming_semaphore:
+                await prepare(function_name, node_name)
 
-class PreWarmedFirstPolicy:
-    async def select_node(self, function_name: str, scheduler):
-        if function_name in state.function_state_registry:
-            for n, s in state.function_state_registry[function_name].items():
-                if s == EXECUTION_MODES.PRE_WARMED.value:
-                    return n, None, EXECUTION_MODES.PRE_WARMED.value
-        return await DefaultColdPolicy().select_node(function_name, scheduler)
+        # One failing node must not cancel the warm-ups still running on the others.
+        results = await asyncio.gather(*(prepare_node(node_name) for node_name in node_names), return_exceptions=True)
+        for node_name, result in zip(node_names, results):
+            if isinstance(result, Exception):
+                logger.error("Unable to warm '%s' on '%s': %s", function_name, node_name, result)
 
 class DefaultColdPolicy:
     async def select_node(self, function_name: str, scheduler):
         node_name, metric_to_write = await scheduler.select_node(state.node_registry, function_name)
         if not node_name:
             raise HTTPException(status_code=503, detail="No suitable nodes available (this may be due to insufficient RAM).")
-        execution_mode = metric_to_write.get("Execution Mode", "Unknown")
-        return node_name, metric_to_write, execution_mode
\ No newline at end of file
+        # The row keeps the policy-qualified label ("<policy> - Cold"); callers branch on the mode value.
+        return node_name, metric_to_write, EXECUTION_MODES.COLD.value
+
+_COLD_POLICY = DefaultColdPolicy()
+
+class _WarmStateFirstPolicy:
+    """
+    Walks a fixed chain of (per-function node sets, execution mode) steps and falls back
+    to a cold start. Warm state is tracked by warmup/prewarm, so the lookups need no SSH
+    probe, and the chain is built once at import, so a miss allocates nothing. When a
+    function is ready on several nodes, the one with the lowest cached load is used.
+    """
+    chain = ()
+
+    async def select_node(self, function_name: str, scheduler):
+        registry = state.node_registry
+        for nodes_by_function, execution_mode in self.chain:
+            node_names = nodes_by_function.get(function_name)
+            if not node_names:
+                continue
+            # A warm-up that finished after its node was unregistered must not route invocations there.
+            if len(node_names) == 1:
+                node_name = next(iter(node_names))
+                if node_name in registry:
+                    return node_name, None, execution_mode
+                continue
+            available = [name for name in node_names if name in registry]
+            if available:
+                return least_loaded_cached(available), None, execution_mode
+        return await _COLD_POLICY.select_node(function_name, scheduler)
+
+class WarmedFirstPolicy(_WarmStateFirstPolicy):
+    chain = (
+        (state.warmed_nodes, EXECUTION_MODES.WARMED.value),
+        (state.prewarmed_nodes, EXECUTION_MODES.PRE_WARMED.value),
+    )
+
+class PreWarmedFirstPolicy(_WarmStateFirstPolicy):
+    chain = ((state.prewarmed_nodes, EXECUTION_MODES.PRE_WARMED.value),)
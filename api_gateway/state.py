@@ -1,11 +1,127 @@
-from typing import Dict, Any, List
+from typing import TYPE_CHECKING, Dict, Any, Deque, Mapping, Optional, Set, Tuple
+from collections import OrderedDict, deque
+from types import MappingProxyType
+import os
 
-function_registry: Dict[str, Dict[str, Any]] = {}
-node_registry: Dict[str, Dict[str, Any]] = {}
-function_state_registry: Dict[str, Dict[str, str]] = {}
-metrics_log: List[Dict[str, Any]] = []
+# start.py imports this module from the host, outside the gateway's import path.
+if TYPE_CHECKING:
+    from models import FunctionRecord
+
+# The registries are immutable snapshots replaced on every write (copy-on-write):
+# readers just load the current reference and never need a lock. Writers only run on
+# the event loop and never await mid-update, so a write is atomic without one either.
+function_registry: Mapping[str, "FunctionRecord"] = MappingProxyType({})
+node_registry: Mapping[str, Dict[str, Any]] = MappingProxyType({})
+# (name, info) pairs in registration order, republished with node_registry so policies can iterate without copying.
+node_items: Tuple[Tuple[str, Dict[str, Any]], ...] = ()
+node_registry_version = 0
+# Passwords and inline private keys live apart from node_registry, which is therefore safe to expose.
+node_secrets: Dict[str, Dict[str, Optional[str]]] = {}
+# Per function, the nodes where it is warmed or pre-warmed; a node is in at most one of the two.
+warmed_nodes: Dict[str, Set[str]] = {}
+prewarmed_nodes: Dict[str, Set[str]] = {}
+# Full 'docker exec' command line per warmed (function, node), built once when the container starts.
+warm_commands: Dict[Tuple[str, str], str] = {}
+# Warmed container ids keyed by (node, image), ordered by last use so each node can evict its LRU entries.
+container_pool: "OrderedDict[Tuple[str, str], str]" = OrderedDict()
+MAX_WARM_CONTAINERS_PER_NODE = 8
+# Rows kept in memory for GET /metrics/table; metrics.csv keeps the full history.
+METRICS_LOG_MAXLEN = 10000
+metrics_log: Deque[Dict[str, Any]] = deque(maxlen=METRICS_LOG_MAXLEN)
+METRICS_BATCH_SIZE = 64
+METRICS_BATCH_TIMEOUT = 0.25
+# Execution times kept per (function, mode) for the quartiles of /metrics/summary.
+METRICS_RESERVOIR_SIZE = 1000
 
 CONTAINER_PREFIX = "faas-scheduler--"
 RESULTS_DIR = "/results"
+LOG_LEVEL = "INFO"
+
+RAM_THRESHOLD = 90
+
+METRICS_CACHE_TTL = 1.5
+METRICS_REFRESH_INTERVAL = 1.0
+METRICS_REFRESH_JITTER = 0.25
+SSH_FANOUT_LIMIT = 8
+# sshd allows 10 sessions per connection by default; one is left for the docker event watcher.
+SSH_MAX_SESSIONS = 9
+# Connections opened to one SSH endpoint at most; the extra ones only open once the first has SSH_MAX_SESSIONS busy.
+SSH_CONNECTIONS_PER_ENDPOINT = 2
+METRICS_PROBE_TIMEOUT = 2.0
+METRICS_STALE_MAX_AGE = 10.0
+METRICS_SELECTION_DEADLINE = 0.5
+# Least Used stops waiting for the other probes once a node reports a load below this (%).
+METRICS_EARLY_EXIT_LOAD = 10.0
+
+# Upper bound for one remote command; cold runs may have to pull their image first.
+SSH_COMMAND_TIMEOUT = 300
+SSH_KEEPALIVE_INTERVAL = 30
+SSH_KEEPALIVE_COUNT_MAX = 3
+# Short command/response traffic gains nothing from compression; AES-GCM is the cheapest cipher per frame.
+SSH_COMPRESSION_ALGS = ["none"]
+SSH_ENCRYPTION_ALGS = ["aes128-gcm@openssh.com", "chacha20-poly1305@openssh.com", "aes128-ctr"]
+KNOWN_HOSTS_PATH = os.path.expanduser("~/.ssh/known_hosts")
+SSH_IDLE_TIMEOUT = 300
+SSH_MAX_AGE = 3600
+SSH_REAPER_INTERVAL = 60
+DOCKER_EVENTS_RETRY_INTERVAL = 5
+# The nodes' Docker daemon socket, reached through a stream-local channel of the pooled SSH connection.
+DOCKER_SOCKET_PATH = "/var/run/docker.sock"
+
+
+def add_function(name: str, details: "FunctionRecord") -> bool:
+    """Publishes a new function_registry snapshot. Returns False if the function already exists."""
+    global function_registry
+    if name in function_registry:
+        return False
+    function_registry = MappingProxyType({**function_registry, name: details})
+    return True
+
+def add_node(name: str, info: Dict[str, Any], secrets: Dict[str, Optional[str]]) -> bool:
+    """
+    Stores the node's secrets, publishes new node_registry and node_items snapshots,
+    then bumps node_registry_version. Returns False if the node already exists.
+    """
+    global node_registry, node_items, node_secrets, node_registry_version
+    if name in node_registry:
+        return False
+    node_secrets = {**node_secrets, name: secrets}
+    node_registry = MappingProxyType({**node_registry, name: info})
+    node_items = (*node_items, (name, info))
+    # Bumped last, so a reader that sees the new version also sees the new registry.
+    node_registry_version += 1
+    return True
+
+def remove_node(name: str) -> Optional[Dict[str, Any]]:
+    """Publishes snapshots without the node and bumps node_registry_version. Returns the removed info."""
+    global node_registry, node_items, node_registry_version
+    if name not in node_registry:
+        return None
+    info = node_registry[name]
+    node_registry = MappingProxyType({key: value for key, value in node_registry.items() if key != name})
+    node_items = tuple(item for item in node_items if item[0] != name)
+    node_registry_version += 1
+    return info
+
+def forget_node_secrets(name: str):
+    """Drops an unregistered node's secrets, once its connection no longer needs them."""
+    global node_secrets
+    if name not in node_registry:
+        node_secrets = {key: value for key, value in node_secrets.items() if key != name}
+
+def mark_warmed(function_name: str, node_name: str, warm_command: str):
+    prewarmed_nodes.get(function_name, set()).discard(node_name)
+    warmed_nodes.setdefault(function_name, set()).add(node_name)
+    warm_commands[(function_name, node_name)] = warm_command
+
+def mark_prewarmed(function_name: str, node_name: str):
+    warmed_nodes.get(function_name, set()).discard(node_name)
+    warm_commands.pop((function_name, node_name), None)
+    prewarmed_nodes.setdefault(function_name, set()).add(node_name)
 
-RAM_THRESHOLD = 90
\ No newline at end of file
+def forget_warm_state(node_name: str):
+    """Removes node_name from the warm state of every function."""
+    for nodes in (*warmed_nodes.values(), *prewarmed_nodes.values()):
+        nodes.discard(node_name)
+    for key in [key for key in warm_commands if key[1] == node_name]:
+        del warm_commands[key]
@@ -1,19 +1,25 @@
 import pandas as pd
+import matplotlib
+matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 import seaborn as sns
 import os
 
 RESULTS_DIR = "/results"
 INPUT_CSV_PATH = os.path.join(RESULTS_DIR, "metrics.csv")
+# Fast zlib level: the plots are regenerated often and the PNGs only grow slightly.
+PNG_OPTIONS = {"pil_kwargs": {"compress_level": 1}}
+
+plt.style.use('seaborn-v0_8-whitegrid')
+# One figure reused for every plot instead of creating (and styling) a new one each time.
+_FIG, _AX = plt.subplots(figsize=(12, 7))
 
 def generate_boxplot(df, function_name, order, color_map):
     """Generate a box plot for a specific function, using a defined order and colors."""
     output_file = os.path.join(RESULTS_DIR, f"metrics_boxplot_{function_name}.png")
     try:
-        df['Execution Time (s)'] = pd.to_numeric(df['Execution Time (s)'])
-        
-        plt.style.use('seaborn-v0_8-whitegrid')
-        fig, ax = plt.subplots(figsize=(12, 7))
+        fig, ax = _FIG, _AX
+        ax.clear()
         
         sns.boxplot(x='Execution Mode', y='Execution Time (s)', data=df, 
                     palette=color_map,
@@ -25,8 +31,7 @@ def generate_boxplot(df, function_name, order, color_map):
         ax.set_ylabel('Execution Time (s)', fontsize=12)
         fig.subplots_adjust(bottom=0.2) 
 
-        plt.savefig(output_file)
-        plt.close(fig)
+        fig.savefig(output_file, **PNG_OPTIONS)
         print(f"✅ Box plot saved in: {output_file}")
     except Exception as e:
         print(f"❌ Error generating box plot for {function_name}: {e}")
@@ -35,7 +40,6 @@ def generate_barchart(df, function_name, order, color_map):
     """Generate a bar chart for a specific function, using a defined order and colors."""
     output_file = os.path.join(RESULTS_DIR, f"metrics_barchart_{function_name}.png")
     try:
-        df['Execution Time (s)'] = pd.to_numeric(df['Execution Time (s)'])
         mean_times = df.groupby('Execution Mode')['Execution Time (s)'].mean()
         
         mean_times = mean_times.reindex(order)
@@ -43,8 +47,10 @@ def generate_barchart(df, function_name, order, color_map):
         valid_order = [m for m in order if m in mean_times.index]
         bar_colors = [color_map[mode] for mode in valid_order]
         
-        plt.style.use('seaborn-v0_8-whitegrid')
-        fig, ax = plt.subplots(figsize=(12, 7))
+        fig, ax = _FIG, _AX
+        ax.clear()
+        # The shared figure keeps the box plot's wider bottom margin otherwise.
+        fig.subplots_adjust(bottom=plt.rcParams['figure.subplot.bottom'])
         
         mean_times.loc[valid_order].plot(kind='bar', ax=ax, color=bar_colors, rot=0)
         
@@ -55,8 +61,7 @@ def generate_barchart(df, function_name, order, color_map):
         if hasattr(ax, 'containers') and ax.containers:
              ax.bar_label(ax.containers[0], fmt='%.4f')
              
-        plt.savefig(output_file)
-        plt.close(fig)
+        fig.savefig(output_file, **PNG_OPTIONS)
         print(f"✅ Bar chart saved in: {output_file}")
     except Exception as e:
         print(f"❌ Error generating bar chart for {function_name}: {e}")
@@ -67,6 +72,7 @@ if __name__ == "__main__":
     else:
         print(f"I read the data from '{INPUT_CSV_PATH}'...")
         dataframe = pd.read_csv(INPUT_CSV_PATH)
+        dataframe['Execution Time (s)'] = pd.to_numeric(dataframe['Execution Time (s)'])
         
         all_modes = dataframe['Execution Mode'].unique()
         
@@ -17,13 +17,14 @@ sed -i 's/#PasswordAuthentication yes/PasswordAuthentication yes/' /etc/ssh/sshd
 sed -i 's/UsePAM yes/UsePAM no/' /etc/ssh/sshd_config
 sed -i 's/ChallengeResponseAuthentication yes/ChallengeResponseAuthentication no/' /etc/ssh/sshd_config
 
-# 3. Add the user to the ‘docker’ group
+# 3. Add the user to the ‘docker’ group, aligned with the GID of the mounted host socket,
+# so the gateway can run plain 'docker' commands without spawning sudo each time
+DOCKER_SOCKET_GID=$(stat -c '%g' /var/run/docker.sock)
+if [ "$(getent group docker | cut -d: -f3)" != "$DOCKER_SOCKET_GID" ]; then
+    groupmod -o -g "$DOCKER_SOCKET_GID" docker
+fi
 usermod -aG docker "$USER"
 
-# Workaround for sudo
-echo "$USER ALL=(ALL) NOPASSWD: /usr/bin/docker" > /etc/sudoers.d/docker-access
-chmod 0440 /etc/sudoers.d/docker-access
-
 # 4. Create the script to retrieve metrics (compatible with cgroups v1 and v2)
 cat << 'EOF' > /usr/local/bin/get_node_metrics.sh
 #!/bin/bash
@@ -86,10 +87,14 @@ else
         'BEGIN { if (limit > 0) printf "%.2f", (used / limit) * 100; else print "0.00" }')
 fi
 
+# Combined load, so the gateway does not have to compose it for every node
+load=$(awk -v cpu="$cpu_usage" -v ram="$ram_usage" 'BEGIN { printf "%.2f", (cpu + ram) / 2 }')
+
 # --- Output JSON ---
 echo "{"
 echo "  \"cpu_usage\": \"$cpu_usage\","
-echo "  \"ram_usage\": \"$ram_usage\""
+echo "  \"ram_usage\": \"$ram_usage\","
+echo "  \"load\": \"$load\""
 echo "}"
 EOF
 